@@ -1,27 +1,299 @@
 import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from enum import Enum
+from typing import List, Literal
 import mlflow
 import dagshub
-import pandas as pd
+import joblib
+import numpy as np
 import json
+import orjson
+import xxhash
+from cachetools import LRUCache
 from flask import Flask, request, jsonify
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from pydantic import TypeAdapter, ValidationError
+from typing_extensions import TypedDict
+
+try:
+    import onnxruntime
+except ImportError:  # ONNX Runtime is optional, the sklearn model is used instead
+    onnxruntime = None
+
+try:
+    import fcntl
+except ImportError:  # No advisory locks on Windows, cache writes are then unserialized
+    fcntl = None
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, with native numpy array support."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 # Initialize Flask app
 app = Flask(__name__)
-CORS(app) # Enable CORS for all routes
+app.json = OrjsonProvider(app)
+
+# Origins allowed to call /predict from a browser, comma separated
+ALLOWED_ORIGINS = [origin.strip() for origin in os.environ.get('ALLOWED_ORIGINS', '*').split(',')
+                   if origin.strip()]
+# Only the prediction endpoint is called cross-origin by the frontend;
+# /health is hit by probes and needs no CORS headers
+CORS(app, resources={r"/predict": {"origins": ALLOWED_ORIGINS}})
 
 # DagsHub and MLflow configuration
 DAGSHUB_REPO_OWNER = 'barnabet'
 DAGSHUB_REPO_NAME = 'projet_devops'
 MODEL_NAME = 'diamond-price-regressor'
+# Run artifact holding the ONNX export of the model (see train.py)
+ONNX_ARTIFACT_PATH = 'diamond-price-onnx'
+
+# Local copy of downloaded model artifacts, keyed by model version and run.
+# Point this at a persistent volume so restarts skip the DagsHub download.
+MODEL_CACHE_DIR = os.environ.get(
+    'MODEL_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_cache'))
+
+# Number of recent per-record predictions kept in memory by /predict
+PREDICTION_CACHE_SIZE = int(os.environ.get('PREDICTION_CACHE_SIZE', 4096))
+
+# Longest wait between two attempts of the background model loader
+MODEL_LOAD_RETRY_MAX = float(os.environ.get('MODEL_LOAD_RETRY_MAX_S', 300))
+
+# How long the micro-batcher waits for concurrent /predict calls to join a batch
+PREDICT_BATCH_WINDOW = float(os.environ.get('PREDICT_BATCH_WINDOW_MS', 5)) / 1000
+
+# Categorical features one-hot encoded by train.py (pd.get_dummies) in
+# models trained with the legacy list of training columns
+CATEGORICAL_FEATURES = ('cut', 'color', 'clarity')
+
+class ModelState(str, Enum):
+    """Lifecycle of the model loaded by load_model(), reported by /health."""
+    NOT_LOADED = "not loaded"
+    LOADING = "loading"
+    LOADED = "loaded"
+    FAILED = "failed"
+
+# Accepted values of the categorical diamond features
+CUTS = ('Fair', 'Good', 'Very Good', 'Premium', 'Ideal')
+COLORS = ('D', 'E', 'F', 'G', 'H', 'I', 'J')
+CLARITIES = ('FL', 'IF', 'VVS1', 'VVS2', 'VS1', 'VS2', 'SI1', 'SI2', 'I1')
+
+class DiamondRecord(TypedDict):
+    """One diamond to price, as posted to /predict."""
+    carat: float
+    cut: Literal[CUTS]
+    color: Literal[COLORS]
+    clarity: Literal[CLARITIES]
+    depth: float
+    table: float
+    x: float
+    y: float
+    z: float
+
+# Compiled once: parses and validates the request body in pydantic-core,
+# yielding plain dicts that build_features() consumes directly
+records_adapter = TypeAdapter(List[DiamondRecord])
 
 model = None
+model_state = ModelState.NOT_LOADED
 training_columns = None
+numeric_cols = None
+onehot_cols = None
+native_cols = None
+# Predictions of recently seen records, keyed by record_key(); cleared
+# whenever a model is loaded. Guarded by a lock for threaded workers.
+prediction_cache = LRUCache(maxsize=PREDICTION_CACHE_SIZE)
+prediction_cache_lock = threading.Lock()
+# Per-thread feature matrix reused by build_features() across requests
+feature_buffers = threading.local()
+
+def record_key(record):
+    """Hash a validated record, independently of its key order."""
+    return xxhash.xxh64_intdigest(orjson.dumps(record, option=orjson.OPT_SORT_KEYS))
+
+def build_feature_index(schema):
+    """Map training columns to their position in the feature matrix.
+
+    `schema` is either the legacy list of one-hot encoded training columns
+    or the feature schema dict written by train.py (columns, dtypes and
+    category levels). Returns three dicts:
+    - numeric column name -> index
+    - one-hot column -> (value -> code, array of one-hot column indices),
+      where code is the position of the value's column in that array
+    - native categorical column -> (value -> category code, index)
+    """
+    numeric = {}
+    onehot = {}
+    native = {}
+    if isinstance(schema, dict):
+        for idx, col in enumerate(schema['columns']):
+            if schema['dtypes'][col] == 'categorical':
+                levels = schema['categories'][col]
+                native[col] = ({value: code for code, value in enumerate(levels)}, idx)
+            else:
+                numeric[col] = idx
+        return numeric, onehot, native
+
+    for idx, col in enumerate(schema):
+        base, sep, value = col.partition('_')
+        if sep and base in CATEGORICAL_FEATURES:
+            onehot.setdefault(base, {})[value] = idx
+        else:
+            numeric[col] = idx
+    onehot = {
+        base: ({value: code for code, value in enumerate(slots)},
+               np.fromiter(slots.values(), dtype=np.intp, count=len(slots)))
+        for base, slots in onehot.items()
+    }
+    return numeric, onehot, native
+
+def feature_buffer(n_rows, n_cols):
+    """Return an uninitialized (n_rows, n_cols) float32 view of this thread's buffer."""
+    buffer = getattr(feature_buffers, 'array', None)
+    if buffer is None or buffer.shape[0] < n_rows or buffer.shape[1] != n_cols:
+        buffer = np.empty((n_rows, n_cols), dtype=np.float32)
+        feature_buffers.array = buffer
+    return buffer[:n_rows]
+
+def build_features(data):
+    """Encode a list of records into the training feature matrix.
+
+    The matrix is written in place into the calling thread's reusable
+    buffer, so it is only valid until the thread's next call; every column
+    is rewritten on each call. Numeric columns are copied as-is. One-hot
+    categorical columns are encoded through an identity matrix lookup;
+    native categorical columns get their category code. Missing numeric
+    columns and unseen one-hot categories (including the dropped first
+    level) stay at 0, unseen native categories are passed to the model as
+    missing (NaN).
+    """
+    n = len(data)
+    X = feature_buffer(n, len(training_columns))
+    for col, idx in numeric_cols.items():
+        X[:, idx] = np.fromiter((record.get(col, 0) for record in data),
+                                dtype=np.float32, count=n)
+    for col, (code_map, cols) in onehot_cols.items():
+        codes = np.fromiter((code_map.get(str(record.get(col)), -1) for record in data),
+                            dtype=np.intp, count=n)
+        # Code -1 picks the extra last eye row, which is all zeros once sliced
+        X[:, cols] = np.eye(len(cols) + 1, dtype=np.float32)[codes, :-1]
+    for col, (code_map, idx) in native_cols.items():
+        X[:, idx] = np.fromiter((code_map.get(str(record.get(col)), np.nan) for record in data),
+                                dtype=np.float32, count=n)
+    return X
+
+class OnnxRegressor:
+    """Serve an ONNX model through the same predict() API as sklearn."""
+
+    def __init__(self, path):
+        self.session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, X):
+        return self.session.run(None, {self.input_name: X.astype(np.float32, copy=False)})[0].ravel()
+
+def load_onnx_model(client, run_id, cache_dir):
+    """Load the run's ONNX model into ONNX Runtime, or return None if unavailable."""
+    if onnxruntime is None:
+        return None
+    onnx_path = os.path.join(cache_dir, ONNX_ARTIFACT_PATH, 'model.onnx')
+    # Written when a run has no ONNX export (it is only shipped when it
+    # matches sklearn), so later boots skip asking MLflow for it again
+    missing_marker = os.path.join(cache_dir, ONNX_ARTIFACT_PATH + '.missing')
+    if os.path.exists(onnx_path):
+        print(f"Using cached ONNX model from: {onnx_path}")
+    elif os.path.exists(missing_marker):
+        print("Run has no ONNX model, using sklearn model")
+        return None
+    else:
+        print(f"Downloading ONNX model from run_id: {run_id}")
+        try:
+            client.download_artifacts(run_id, ONNX_ARTIFACT_PATH, cache_dir)
+        except Exception as e:
+            print(f"ONNX model not available, using sklearn model: {e}")
+        if not os.path.exists(onnx_path):
+            os.makedirs(cache_dir, exist_ok=True)
+            open(missing_marker, 'w').close()
+            return None
+    try:
+        return OnnxRegressor(onnx_path)
+    except Exception as e:
+        print(f"ONNX model not available, using sklearn model: {e}")
+        return None
+
+@contextmanager
+def cache_dir_lock(cache_dir):
+    """Hold an exclusive lock on a model cache directory across processes.
+
+    Every gunicorn worker loads the model itself; the first one to take the
+    lock fills the cache while the others wait and then reuse it.
+    """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+    with open(cache_dir + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+def load_model_artifact(client, model_uri, run_id, cache_dir):
+    """Load the model of a run, preferring ONNX, then the cached joblib copy."""
+    model_dir = os.path.join(cache_dir, 'model')
+    # Uncompressed joblib copy of the model, memory-mapped read-only so
+    # forked workers share its pages instead of each holding a copy
+    model_pickle = os.path.join(cache_dir, 'model.joblib')
+    onnx_model = load_onnx_model(client, run_id, cache_dir)
+    if onnx_model is not None:
+        loaded_model = onnx_model
+    elif os.path.exists(model_pickle):
+        print(f"Using cached model from: {model_pickle}")
+        loaded_model = joblib.load(model_pickle, mmap_mode='r')
+    else:
+        if os.path.exists(os.path.join(model_dir, 'MLmodel')):
+            print(f"Using cached model artifacts from: {model_dir}")
+        else:
+            print(f"Downloading model from URI: {model_uri}")
+            os.makedirs(model_dir, exist_ok=True)
+            mlflow.artifacts.download_artifacts(artifact_uri=model_uri, dst_path=model_dir)
+        loaded_model = mlflow.sklearn.load_model(model_dir)
+        try:
+            # Write then rename so an interrupted dump never leaves a truncated cache
+            # (per process, as every gunicorn worker loads the model itself)
+            tmp_pickle = f"{model_pickle}.{os.getpid()}.tmp"
+            joblib.dump(loaded_model, tmp_pickle, compress=0)
+            os.replace(tmp_pickle, model_pickle)
+        except Exception as e:
+            print(f"⚠️ Could not cache model to {model_pickle}: {e}")
+    print("Model loaded successfully.")
+    return loaded_model
+
+def load_feature_schema(client, run_id, cache_dir):
+    """Load the training columns artifact of a run from the cache or MLflow."""
+    columns_path = os.path.join(cache_dir, 'model_meta', 'training_columns.json')
+    if os.path.exists(columns_path):
+        print(f"Using cached training columns from: {columns_path}")
+    else:
+        print(f"Downloading artifact from run_id: {run_id}")
+        client.download_artifacts(run_id, "model_meta", cache_dir)
+    with open(columns_path, 'r') as f:
+        feature_schema = json.load(f)
+    print("Training columns loaded successfully.")
+    return feature_schema
 
 def load_model():
     """Load the latest model and training columns from MLflow."""
-    global model, training_columns
+    global model, training_columns, numeric_cols, onehot_cols, native_cols, model_state
     
+    model_state = ModelState.LOADING
     try:
         print("🔄 Initializing DagsHub...")
         
@@ -42,15 +314,17 @@ def load_model():
         
         # Try to load from Production stage first
         model_uri = None
+        model_version = None
         run_id = None
         
         try:
             print("Trying to load model from Production stage...")
-            model_uri = f"models:/{MODEL_NAME}/Production"
             latest_versions = client.get_latest_versions(name=MODEL_NAME, stages=["Production"])
             if latest_versions:
+                model_uri = f"models:/{MODEL_NAME}/Production"
+                model_version = latest_versions[0].version
                 run_id = latest_versions[0].run_id
-                print(f"Found Production model with run_id: {run_id}")
+                print(f"Found Production model version {model_version} with run_id: {run_id}")
         except Exception as e:
             print(f"Production model not found: {e}")
         
@@ -62,6 +336,7 @@ def load_model():
                 if latest_versions:
                     latest_version = latest_versions[0]
                     model_uri = f"models:/{MODEL_NAME}/{latest_version.version}"
+                    model_version = latest_version.version
                     run_id = latest_version.run_id
                     print(f"Found latest model version {latest_version.version} with run_id: {run_id}")
             except Exception as e:
@@ -71,24 +346,105 @@ def load_model():
         if model_uri is None or run_id is None:
             raise Exception(f"No model found for '{MODEL_NAME}'. Please ensure the model is registered in MLflow.")
         
-        print(f"Loading model from URI: {model_uri}")
-        model = mlflow.sklearn.load_model(model_uri)
-        print("Model loaded successfully.")
+        # Artifacts of a given version/run never change, so a cached copy can be reused
+        cache_dir = os.path.join(MODEL_CACHE_DIR, f"{MODEL_NAME}-v{model_version}-{run_id}")
 
-        # Download the training columns artifact
-        print(f"Downloading artifact from run_id: {run_id}")
-        local_path = client.download_artifacts(run_id, "model_meta", ".")
-        
-        # Load the columns
-        with open(os.path.join(local_path, 'training_columns.json'), 'r') as f:
-            training_columns = json.load(f)
-        print("Training columns loaded successfully.")
+        # Once the run is known the model and its training columns are
+        # independent downloads, so fetch them concurrently. Downloads write
+        # in place, so other workers wait on the lock rather than read a
+        # partial cache.
+        with cache_dir_lock(cache_dir), ThreadPoolExecutor(max_workers=2) as executor:
+            model_future = executor.submit(load_model_artifact, client, model_uri, run_id, cache_dir)
+            schema_future = executor.submit(load_feature_schema, client, run_id, cache_dir)
+            feature_schema = schema_future.result()
+            loaded_model = model_future.result()
+
+        if isinstance(feature_schema, dict):
+            training_columns = feature_schema['columns']
+        else:
+            training_columns = feature_schema
+        numeric_cols, onehot_cols, native_cols = build_feature_index(feature_schema)
+        model = loaded_model
+        with prediction_cache_lock:
+            prediction_cache.clear()
+        model_state = ModelState.LOADED
         print(f"Ready to serve predictions! Model loaded with {len(training_columns)} features.")
         
     except Exception as e:
+        model_state = ModelState.FAILED
         print(f"Error loading model: {e}")
         print("Backend will start but predictions will not work until model is available.")
 
+class MicroBatcher:
+    """Coalesce concurrent predictions into a single model.predict call.
+
+    Callers block on predict(X) while a worker thread collects the feature
+    matrices queued within `window` seconds of the first one, predicts
+    them as one stacked batch and hands each caller its own rows back.
+    """
+
+    def __init__(self, window=PREDICT_BATCH_WINDOW):
+        self.window = window
+        self.queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker_pid = None
+
+    def predict(self, X):
+        self._ensure_worker()
+        future = Future()
+        self.queue.put((X, future))
+        return future.result()
+
+    def _ensure_worker(self):
+        # Threads do not survive a fork, so each gunicorn worker starts its own
+        if self._worker_pid != os.getpid():
+            with self._lock:
+                if self._worker_pid != os.getpid():
+                    threading.Thread(target=self._run, daemon=True).start()
+                    self._worker_pid = os.getpid()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                y = np.asarray(model.predict(np.vstack([X for X, _ in batch])))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for X, future in batch:
+                future.set_result(y[start:start + len(X)])
+                start += len(X)
+
+predict_batcher = MicroBatcher()
+
+def load_model_until_loaded():
+    """Call load_model() until it succeeds, backing off between attempts."""
+    delay = 1
+    while True:
+        load_model()
+        if model_state == ModelState.LOADED:
+            return
+        print(f"🔁 Retrying model load in {delay:g}s...")
+        time.sleep(delay)
+        delay = min(delay * 2, MODEL_LOAD_RETRY_MAX)
+
+def start_model_loading():
+    """Load the model in a background thread so the server can start right away."""
+    model_thread = threading.Thread(target=load_model_until_loaded, daemon=True)
+    model_thread.start()
+    return model_thread
+
 @app.route('/predict', methods=['POST'])
 def predict():
     """Receive prediction data, preprocess, and return prediction."""
@@ -98,22 +454,36 @@ def predict():
         }), 500
 
     try:
-        # Get data from request
-        data = request.get_json()
-        df = pd.DataFrame(data)
+        # Parse and validate the request body in one pass
+        data = records_adapter.validate_json(request.get_data())
+    except ValidationError as e:
+        return jsonify({
+            "error": "Invalid diamond data",
+            "details": e.errors(include_url=False, include_context=False, include_input=False)
+        }), 422
 
-        # Preprocess the data to match training format
-        # One-hot encode categorical features
-        df_processed = pd.get_dummies(df)
-        
-        # Reindex to match training columns
-        # This adds missing columns with 0 and removes extra columns
-        df_aligned = df_processed.reindex(columns=training_columns, fill_value=0)
+    try:
+        # Serve repeated records from the cache, predict the rest in one batch
+        keys = [record_key(record) for record in data]
+        with prediction_cache_lock:
+            prediction = [prediction_cache.get(key) for key in keys]
+        missing = [i for i, price in enumerate(prediction) if price is None]
 
-        # Make prediction
-        prediction = model.predict(df_aligned)
-        
-        return jsonify({"predicted_price": prediction.tolist()})
+        if missing:
+            # Preprocess the data to match training format
+            X = build_features([data[i] for i in missing])
+
+            # Make prediction
+            prices = np.ascontiguousarray(predict_batcher.predict(X))
+            with prediction_cache_lock:
+                for i, price in zip(missing, prices):
+                    prediction[i] = price
+                    prediction_cache[keys[i]] = price
+            if len(missing) == len(data):
+                # Nothing came from the cache, orjson serializes the array as-is
+                prediction = prices
+
+        return jsonify({"predicted_price": prediction})
 
     except Exception as e:
         return jsonify({"error": str(e)}), 400
@@ -121,7 +491,7 @@ def predict():
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint."""
-    model_status = "loaded" if model is not None else "not loaded"
+    model_status = model_state.value
     training_columns_status = "loaded" if training_columns is not None else "not loaded"
     
     # Always return 200 OK for health check - service is running
@@ -141,14 +511,10 @@ if __name__ == '__main__':
     print("🔮 Prediction endpoint: http://127.0.0.1:5000/predict")
     
     # Load model in background to not block server startup
-    import threading
-    model_thread = threading.Thread(target=load_model)
-    model_thread.daemon = True
-    model_thread.start()
-    
-    print("📦 Model loading started in background...")
+    if model_state == ModelState.NOT_LOADED:
+        start_model_loading()
+        print("📦 Model loading started in background...")
     print("✅ Server is ready to accept requests!")
     
-    # To run locally: flask run
-    # For production, use a Gunicorn server
+    # Development server only; production runs gunicorn (see Dockerfile)
     app.run(host='0.0.0.0', port=os.getenv("PORT", 5000), debug=False) 
\ No newline at end of file
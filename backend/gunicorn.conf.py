@@ -0,0 +1,11 @@
+"""Gunicorn settings for the backend image (see Dockerfile)."""
+
+def post_fork(server, worker):
+    """Start loading the model in each worker once it has forked.
+
+    Threads do not survive a fork, so the background loader is started here
+    rather than in the master. The worker binds and answers /health with
+    model_status=loading while the model downloads.
+    """
+    from app import start_model_loading
+    start_model_loading()
@@ -1,13 +1,27 @@
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor
+from sklearn.ensemble import HistGradientBoostingRegressor
 from sklearn.metrics import mean_squared_error
 import mlflow
 import mlflow.sklearn
+import mlflow.onnx
+import numpy as np
+import onnxruntime
+from skl2onnx import convert_sklearn
+from skl2onnx.common.data_types import FloatTensorType
 import dagshub
 import dvc.api
 import os
-import json
+
+# Category levels of each categorical feature, in grade order. The model
+# uses them natively (as ordinal codes) instead of one-hot columns.
+CATEGORICAL_FEATURES = {
+    'cut': ['Fair', 'Good', 'Very Good', 'Premium', 'Ideal'],
+    'color': ['J', 'I', 'H', 'G', 'F', 'E', 'D'],
+    'clarity': ['I1', 'SI2', 'SI1', 'VS2', 'VS1', 'VVS2', 'VVS1', 'IF'],
+}
 
 # Initialize DagsHub integration with MLflow
 dagshub.init(repo_owner='barnabet', repo_name='projet_devops', mlflow=True)
@@ -15,22 +29,34 @@ dagshub.init(repo_owner='barnabet', repo_name='projet_devops', mlflow=True)
 print("Loading data...")
 # Load data using the local DVC setup.
 # Make sure to run `dvc pull` if you don't have the data locally.
+# pyarrow's multithreaded parser reads the categorical columns straight
+# into dictionary arrays, which become pandas categoricals
 with dvc.api.open(
-    'data/diamonds.csv'
+    'data/diamonds.csv', mode='rb'
 ) as fd:
-    df = pd.read_csv(fd)
+    table = pacsv.read_csv(fd, convert_options=pacsv.ConvertOptions(
+        column_types={col: pa.dictionary(pa.int32(), pa.string()) for col in CATEGORICAL_FEATURES}
+    ))
+df = table.to_pandas()
 
 print("Preprocessing data...")
-# Simple feature engineering and preprocessing
-df = pd.get_dummies(df, columns=['cut', 'color', 'clarity'], drop_first=True)
+# Encode categorical features as category codes; unknown levels become missing
+for col, categories in CATEGORICAL_FEATURES.items():
+    codes = pd.Categorical(df[col], categories=categories).codes.astype('float32')
+    codes[codes < 0] = float('nan')
+    df[col] = codes
 
 # Define features and target
 X = df.drop('price', axis=1)
 y = df['price']
 
-# Save training columns for inference
-with open("training_columns.json", "w") as f:
-    json.dump(X.columns.tolist(), f)
+# Save the raw feature schema for inference: column order, the dtype of
+# each column and the category levels behind each categorical code
+feature_schema = {
+    "columns": X.columns.tolist(),
+    "dtypes": {col: "categorical" if col in CATEGORICAL_FEATURES else "numeric" for col in X.columns},
+    "categories": CATEGORICAL_FEATURES,
+}
 
 # Split data
 X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
@@ -39,13 +65,23 @@ X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_
 with mlflow.start_run(nested=True):
     print("Training model...")
     # Log parameters
-    n_estimators = 100
+    max_iter = 300
+    learning_rate = 0.05
+    max_bins = 255
     random_state = 42
-    mlflow.log_param("n_estimators", n_estimators)
+    mlflow.log_param("max_iter", max_iter)
+    mlflow.log_param("learning_rate", learning_rate)
+    mlflow.log_param("max_bins", max_bins)
     mlflow.log_param("random_state", random_state)
 
     # Train model
-    model = RandomForestRegressor(n_estimators=n_estimators, random_state=random_state, n_jobs=-1)
+    model = HistGradientBoostingRegressor(
+        max_iter=max_iter,
+        learning_rate=learning_rate,
+        max_bins=max_bins,
+        categorical_features=[X.columns.get_loc(col) for col in CATEGORICAL_FEATURES],
+        random_state=random_state
+    )
     model.fit(X_train, y_train)
 
     # Make predictions
@@ -56,8 +92,8 @@ with mlflow.start_run(nested=True):
     mlflow.log_metric("rmse", rmse)
     print(f"Logged RMSE: {rmse}")
 
-    # Log the training columns as an artifact
-    mlflow.log_artifact("training_columns.json", "model_meta")
+    # Log the feature schema as an artifact, serialized in memory
+    mlflow.log_dict(feature_schema, "model_meta/training_columns.json")
 
     # Log the model with a registered name
     MODEL_NAME = "diamond-price-regressor"
@@ -66,6 +102,26 @@ with mlflow.start_run(nested=True):
         artifact_path="diamond-price-model",
         registered_model_name=MODEL_NAME
     )
+
+    # Log an ONNX export of the model next to it; the backend serves it with
+    # ONNX Runtime when available and falls back to the sklearn model otherwise
+    try:
+        onnx_model = convert_sklearn(
+            model, initial_types=[('input', FloatTensorType([None, X.shape[1]]))]
+        )
+        # Only ship the export if it reproduces the sklearn predictions
+        session = onnxruntime.InferenceSession(
+            onnx_model.SerializeToString(), providers=['CPUExecutionProvider']
+        )
+        X_check = X_test.to_numpy(dtype=np.float32)
+        onnx_predictions = session.run(None, {'input': X_check})[0].ravel()
+        if np.allclose(onnx_predictions, predictions, rtol=1e-3, atol=1e-2):
+            mlflow.onnx.log_model(onnx_model, artifact_path="diamond-price-onnx")
+            print("Logged ONNX model.")
+        else:
+            print("⚠️ ONNX export does not match sklearn predictions, skipping it.")
+    except Exception as e:
+        print(f"⚠️ Could not export model to ONNX: {e}")
     
     # Find the latest version of the model
     client = mlflow.tracking.MlflowClient()
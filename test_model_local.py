@@ -7,9 +7,9 @@ Run this to test your credentials before using docker-compose
 import os
 import mlflow
 
-# Set your DagsHub credentials here
-DAGSHUB_USERNAME = "Barnabet"
-DAGSHUB_TOKEN = "your_token_here"  # Replace with your actual token
+# DagsHub credentials, read from the environment like the backend does
+DAGSHUB_USERNAME = os.environ.get('DAGSHUB_USERNAME', 'Barnabet')
+DAGSHUB_TOKEN = os.environ.get('DAGSHUB_TOKEN', '')
 
 # Set environment variables
 os.environ['MLFLOW_TRACKING_USERNAME'] = DAGSHUB_USERNAME
@@ -28,31 +28,32 @@ try:
     model_name = "diamond-price-regressor"
     print(f"🔍 Looking for model: {model_name}")
     
-    # Check for Production models
+    # Fetch every version in one round trip, then filter locally
     try:
-        latest_versions = client.get_latest_versions(name=model_name, stages=["Production"])
-        if latest_versions:
-            print(f"✅ Found Production model: version {latest_versions[0].version}")
-        else:
-            print("⚠️ No Production model found")
+        versions = client.search_model_versions(f"name='{model_name}'")
     except Exception as e:
-        print(f"❌ Production model check failed: {e}")
+        print(f"❌ Model check failed: {e}")
+        versions = []
+    
+    # Check for Production models
+    production = [v for v in versions if v.current_stage == "Production"]
+    if production:
+        latest_production = max(production, key=lambda v: int(v.version))
+        print(f"✅ Found Production model: version {latest_production.version}")
+    else:
+        print("⚠️ No Production model found")
     
     # Check for any models
-    try:
-        all_versions = client.get_latest_versions(name=model_name)
-        if all_versions:
-            print(f"✅ Found {len(all_versions)} model versions")
-            for v in all_versions:
-                print(f"   - Version {v.version} in stage: {v.current_stage}")
-        else:
-            print("❌ No models found at all")
-    except Exception as e:
-        print(f"❌ Model check failed: {e}")
+    if versions:
+        print(f"✅ Found {len(versions)} model versions")
+        for v in sorted(versions, key=lambda v: int(v.version), reverse=True):
+            print(f"   - Version {v.version} in stage: {v.current_stage}")
+    else:
+        print("❌ No models found at all")
         
     print("✅ Connection test completed!")
     
 except Exception as e:
     print(f"❌ Connection failed: {e}")
-    print("\n🔧 Fix: Update DAGSHUB_TOKEN in this script with your real token from:")
+    print("\n🔧 Fix: Set DAGSHUB_TOKEN in your environment to your real token from:")
     print("https://dagshub.com/user/settings/tokens") 
\ No newline at end of file
@@ -0,0 +1,435 @@
+"""
+Shared fixtures for the Diamond Price Prediction test suites
+
+The unit and integration tests share one Flask test client. The E2E
+fixtures start one backend server for the whole test session and lend
+tests Chrome browsers from a pool instead of starting one per test class.
+"""
+
+import json
+import os
+import queue
+import signal
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+from unittest.mock import Mock, patch
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+# Readiness probe delays: 10ms doubling up to 0.5s, about 30s in total
+READY_BACKOFF = [min(0.01 * 2 ** i, 0.5) for i in range(6)] + [0.5] * 58
+# How long to wait for a started backend to finish loading its model
+MODEL_LOAD_TIMEOUT = float(os.environ.get('MODEL_LOAD_TIMEOUT', 120))
+
+# One-hot training schema of the legacy (pd.get_dummies) models
+TRAINING_COLUMNS = [
+    'carat', 'depth', 'table', 'x', 'y', 'z',
+    'cut_Fair', 'cut_Good', 'cut_Ideal', 'cut_Premium', 'cut_Very Good',
+    'color_D', 'color_E', 'color_F', 'color_G', 'color_H', 'color_I', 'color_J',
+    'clarity_I1', 'clarity_IF', 'clarity_SI1', 'clarity_SI2', 'clarity_VS1', 'clarity_VS2',
+    'clarity_VVS1', 'clarity_VVS2'
+]
+
+# Module-level model state of the backend, set by load_model() and the tests
+MODEL_GLOBALS = ('model', 'model_state', 'training_columns', 'numeric_cols', 'onehot_cols',
+                 'native_cols', 'prediction_cache', 'feature_buffers')
+
+# Sample diamond records; IDEAL_DIAMOND is the frontend form's default
+IDEAL_DIAMOND = {'carat': 0.23, 'cut': 'Ideal', 'color': 'E', 'clarity': 'SI2',
+                 'depth': 61.5, 'table': 55.0, 'x': 3.95, 'y': 3.98, 'z': 2.43}
+PREMIUM_DIAMOND = {'carat': 0.5, 'cut': 'Premium', 'color': 'G', 'clarity': 'VS1',
+                   'depth': 62.0, 'table': 57.0, 'x': 5.0, 'y': 5.0, 'z': 3.1}
+
+# Pinned chromedriver binary; unset lets Selenium Manager find or fetch one
+CHROMEDRIVER = os.environ.get('CHROMEDRIVER')
+# Already running backend to test against instead of starting one per worker
+BACKEND_URL = os.environ.get('BACKEND_URL')
+
+
+def pytest_addoption(parser):
+    parser.addoption("--no-selenium", action="store_true",
+                     help="skip the tests that drive a Chrome browser")
+
+
+def pytest_collection_modifyitems(config, items):
+    if not config.getoption("--no-selenium"):
+        return
+    skip_selenium = pytest.mark.skip(reason="--no-selenium given")
+    for item in items:
+        if "web_driver" in getattr(item, "fixturenames", ()):
+            item.add_marker(skip_selenium)
+
+
+@pytest.fixture(scope="session")
+def client():
+    """One Flask test client for the backend app, shared by the whole session
+
+    TESTING is left at its default: /predict handles its own errors, and the
+    flag would leak into tests that check the app's default configuration.
+    """
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    from app import app
+    return app.test_client()
+
+
+@pytest.fixture(scope="session")
+def ideal_diamond():
+    """The frontend's default diamond record, shared by all tests: do not mutate"""
+    return IDEAL_DIAMOND
+
+
+@pytest.fixture(scope="session")
+def premium_diamond():
+    """A Premium/G/VS1 diamond record, shared by all tests: do not mutate"""
+    return PREMIUM_DIAMOND
+
+
+@pytest.fixture(scope="session")
+def feature_template():
+    """A one-row, all-zero int8 DataFrame over TRAINING_COLUMNS: copy before writing"""
+    import numpy as np
+    import pandas as pd
+
+    return pd.DataFrame(np.zeros((1, len(TRAINING_COLUMNS)), dtype=np.int8), columns=TRAINING_COLUMNS)
+
+
+@pytest.fixture(scope="session")
+def training_columns_roundtripped():
+    """TRAINING_COLUMNS after a JSON round trip, as load_model reads them back"""
+    return json.loads(json.dumps(TRAINING_COLUMNS))
+
+
+@pytest.fixture(scope="session")
+def mock_predictor():
+    """A model stand-in whose predict returns a float32 array, like the real models"""
+    import numpy as np
+
+    predictor = Mock()
+    predictor.predict.return_value = np.array([1500.0], dtype=np.float32)
+    return predictor
+
+
+@pytest.fixture
+def install_model(monkeypatch):
+    """Install a feature schema and a mock model in the backend
+
+    Returns a function taking the training columns and returning the mock
+    model, with an empty prediction cache and feature buffer. The backend's
+    model state is restored after the test, so tests that run load_model()
+    take this fixture without calling it.
+    """
+    import threading
+    import app as backend
+
+    for name in MODEL_GLOBALS:
+        monkeypatch.setattr(backend, name, getattr(backend, name))
+
+    def install(columns):
+        model = Mock()
+        backend.model = model
+        backend.model_state = backend.ModelState.LOADED
+        backend.training_columns = columns
+        backend.numeric_cols, backend.onehot_cols, backend.native_cols = \
+            backend.build_feature_index(columns)
+        backend.prediction_cache = backend.LRUCache(maxsize=backend.PREDICTION_CACHE_SIZE)
+        backend.feature_buffers = threading.local()
+        return model
+
+    return install
+
+
+@pytest.fixture
+def encode_features(install_model):
+    """Encode records with the backend's feature kernel over TRAINING_COLUMNS
+
+    Returns a function mapping a list of records to a DataFrame with one
+    column per training column.
+    """
+    import pandas as pd
+    import app as backend
+
+    install_model(TRAINING_COLUMNS)
+
+    def encode(records):
+        # build_features reuses its buffer, so copy the rows out
+        return pd.DataFrame(backend.build_features(records).copy(), columns=TRAINING_COLUMNS)
+
+    return encode
+
+
+@pytest.fixture
+def mocked_mlflow(monkeypatch, tmp_path, install_model):
+    """Patch the DagsHub and MLflow calls of load_model with prepared mocks
+
+    The registry returns version 1 of run test-run-id, whose training
+    columns artifact downloads as ['col1', 'col2'] into a model cache under
+    tmp_path; the run has no ONNX export. The backend's model state is
+    restored after the test.
+    """
+    monkeypatch.setenv('DAGSHUB_USERNAME', 'test')
+    monkeypatch.setenv('DAGSHUB_TOKEN', 'test')
+    monkeypatch.setattr('app.MODEL_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr('app.mlflow.set_tracking_uri', Mock())
+
+    def download_artifacts(run_id, path, dst_path):
+        if path != 'model_meta':
+            raise OSError(f"No artifact {path} in run {run_id}")
+        os.makedirs(os.path.join(dst_path, path), exist_ok=True)
+        with open(os.path.join(dst_path, path, 'training_columns.json'), 'w') as f:
+            json.dump(['col1', 'col2'], f)
+        return os.path.join(dst_path, path)
+
+    # mlflow.sklearn is lazily imported, patch the real module rather than
+    # the attribute of app.mlflow so the mock holds whatever ran before
+    with patch('mlflow.sklearn.load_model') as load_model, \
+            patch('app.mlflow.tracking.MlflowClient') as mlflow_client, \
+            patch('app.mlflow.artifacts.download_artifacts') as download_model, \
+            patch('app.joblib.dump') as dump:
+        load_model.return_value = Mock()
+        mlflow_client.return_value.get_latest_versions.return_value = [
+            Mock(run_id='test-run-id', version='1')
+        ]
+        mlflow_client.return_value.download_artifacts.side_effect = download_artifacts
+        yield SimpleNamespace(load_model=load_model, client=mlflow_client,
+                              download_model=download_model, dump=dump)
+
+
+@pytest.fixture(scope="session")
+def backend_port():
+    """Port of this session's backend: 5000, plus the pytest-xdist worker number"""
+    worker = os.environ.get('PYTEST_XDIST_WORKER', 'gw0')
+    return 5000 + int(worker[2:])
+
+
+@pytest.fixture(scope="session")
+def backend_url(backend_port):
+    """Base URL of this session's backend, BACKEND_URL when set"""
+    return BACKEND_URL or f'http://127.0.0.1:{backend_port}'
+
+
+@pytest.fixture(scope="session")
+def http_session():
+    """One keep-alive requests.Session shared by every API test
+
+    Connection errors and transient gateway errors of idempotent calls are retried.
+    """
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(pool_connections=10, pool_maxsize=10,
+                                         max_retries=Retry(total=3, backoff_factor=0.1,
+                                                           status_forcelist=[502, 503, 504],
+                                                           raise_on_status=False)))
+    yield session
+    session.close()
+
+
+@pytest.fixture(scope="session")
+def backend_ready(backend_server, backend_url, http_session):
+    """Probe /health once per session and skip API tests if the backend is down
+
+    Depends on backend_server, so each worker first starts its own backend.
+    Returns the health payload so tests can check the model status.
+    """
+    try:
+        response = http_session.get(f'{backend_url}/health', timeout=2)
+    except requests.exceptions.RequestException:
+        pytest.skip("Backend not running - skipping API tests")
+    if response.status_code != 200:
+        pytest.skip("Backend not healthy - skipping API tests")
+    return response.json()
+
+
+@pytest.fixture(scope="session")
+def model_status(backend_ready, backend_url, http_session):
+    """Wait for the backend to finish loading its model and return the status
+
+    The backend loads its model in the background, so /health is polled
+    until model_status is 'loaded' or 'failed', for at most MODEL_LOAD_TIMEOUT.
+    """
+    status = backend_ready['model_status']
+    deadline = time.monotonic() + MODEL_LOAD_TIMEOUT
+    while status not in ('loaded', 'failed') and time.monotonic() < deadline:
+        time.sleep(0.5)
+        status = http_session.get(f'{backend_url}/health', timeout=2).json()['model_status']
+    return status
+
+
+@pytest.fixture(scope="session")
+def warm_model(model_status, backend_url, http_session):
+    """Send one throwaway prediction so timed requests see a warmed-up model
+
+    Skips when the model did not load within MODEL_LOAD_TIMEOUT.
+    """
+    if model_status != 'loaded':
+        pytest.skip("Model not loaded - nothing to warm up")
+    response = http_session.post(f'{backend_url}/predict', json=[IDEAL_DIAMOND], timeout=30)
+    assert response.status_code == 200, f"Warm-up prediction failed: {response.text}"
+
+
+@pytest.fixture(scope="session")
+def predict(backend_url, http_session):
+    """POST a payload to /predict, reusing the response for identical payloads
+
+    Pass force=True to always send a fresh request.
+    """
+    responses = {}
+
+    def _predict(payload, timeout=15, force=False):
+        key = json.dumps(payload, sort_keys=True)
+        if force or key not in responses:
+            responses[key] = http_session.post(f'{backend_url}/predict', json=payload, timeout=timeout)
+        return responses[key]
+
+    return _predict
+
+
+def wait_until_healthy(url):
+    """Poll url with exponential backoff over one connection; True once it answers 200"""
+    with requests.Session() as probe:
+        probe.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        for delay in READY_BACKOFF:
+            try:
+                if probe.get(url, timeout=0.5).status_code == 200:
+                    return True
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(delay)
+    return False
+
+
+def stop_process_group(process):
+    """Terminate a process started with start_new_session=True and its children"""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+@pytest.fixture(scope="session")
+def backend_server(backend_port, backend_url):
+    """Start the backend server once for the whole test session"""
+    if BACKEND_URL:
+        yield "external"
+        return
+
+    try:
+        # Check if backend is already running
+        response = requests.get(f'{backend_url}/health', timeout=2)
+        if response.status_code == 200:
+            yield "already_running"
+            return
+    except requests.exceptions.RequestException:
+        pass
+
+    # Start backend server; its output is discarded so a full pipe can never
+    # block it, and its own process group lets teardown reach any children
+    backend_process = subprocess.Popen(
+        [sys.executable, 'app.py'],
+        cwd=BACKEND_DIR,
+        env=dict(os.environ, PORT=str(backend_port)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        close_fds=True,
+        start_new_session=True
+    )
+
+    if not wait_until_healthy(f'{backend_url}/health'):
+        stop_process_group(backend_process)
+        pytest.skip("Could not start backend server for E2E tests")
+
+    yield backend_process
+
+    # Cleanup
+    stop_process_group(backend_process)
+
+
+def new_chrome():
+    """Start a headless Chrome WebDriver"""
+    # Imported here so API-only test runs do not need Selenium
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
+
+    chrome_options = Options()
+    chrome_options.add_argument("--headless=new")  # Run in the new headless mode
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--window-size=1920,1080")
+    # Skip work the form tests never look at
+    for flag in ("--disable-extensions", "--disable-background-networking",
+                 "--disable-renderer-backgrounding", "--disable-sync",
+                 "--no-first-run", "--no-default-browser-check",
+                 "--blink-settings=imagesEnabled=false"):
+        chrome_options.add_argument(flag)
+    chrome_options.add_experimental_option(
+        "prefs", {"profile.managed_default_content_settings.images": 2})
+
+    service = Service(executable_path=CHROMEDRIVER)
+    driver = webdriver.Chrome(service=service, options=chrome_options)
+    return driver
+
+
+class BrowserPool:
+    """Idle Chrome instances handed out to tests and returned after each one
+
+    A browser is only started when none is idle, so a pytest-xdist worker
+    runs all its Selenium tests on the Chrome it started first.
+    """
+
+    def __init__(self, factory=new_chrome):
+        self._factory = factory
+        self._idle = queue.Queue()
+        self._drivers = []
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            driver = self._factory()
+            self._drivers.append(driver)
+            return driver
+
+    def release(self, driver):
+        self._idle.put(driver)
+
+    def close(self):
+        for driver in self._drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        self._drivers.clear()
+
+
+@pytest.fixture(scope="session")
+def browser_pool():
+    """Chrome pool shared by the whole test session"""
+    pool = BrowserPool()
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def web_driver(browser_pool):
+    """Lend a pooled Chrome to a test, then clear its cookies and put it back
+
+    The page is left open so the next test can reuse it (see test_e2e.py).
+    """
+    try:
+        driver = browser_pool.acquire()
+    except Exception as e:
+        pytest.skip(f"Could not set up Chrome WebDriver: {e}")
+
+    yield driver
+
+    driver.delete_all_cookies()
+    browser_pool.release(driver)
@@ -9,24 +9,91 @@ import subprocess
 import sys
 import os
 import argparse
+import glob
+import hashlib
+import json
 
-def run_command(cmd, description):
-    """Run a command and return success status"""
+# Spread tests over all CPU cores with pytest-xdist, one test at a time so
+# the Selenium tests of a class run side by side; every worker starts its
+# own E2E backend on port 5000 + worker number and its own pooled Chrome
+# (see conftest.py)
+PYTEST_ARGS = ['-n', 'auto', '--dist', 'load']
+if os.environ.get('CI'):
+    # CI runners start from a clean checkout, so skip writing .pytest_cache
+    PYTEST_ARGS += ['-p', 'no:cacheprovider']
+else:
+    # Run the tests that failed last time first, for a faster red signal
+    PYTEST_ARGS += ['--ff']
+
+# Digest of the test inputs at the last passing run of each suite
+LAST_GREEN_FILE = '.tests.lastgreen'
+# Files whose content decides whether a previous green run is still valid
+TEST_INPUTS = ('backend/**/*.py', 'tests/**/*.py', 'backend/requirements.txt',
+               'tests/requirements.txt', 'frontend/index.html')
+
+def inputs_digest(suite):
+    """Hash the suite name and the content of every test input file"""
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    digest = hashlib.sha256(suite.encode())
+    paths = set()
+    for pattern in TEST_INPUTS:
+        paths.update(glob.glob(os.path.join(root, pattern), recursive=True))
+    for path in sorted(paths):
+        digest.update(os.path.relpath(path, root).encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def load_last_green():
+    """Return the input digests of the last green run of each suite"""
+    try:
+        with open(LAST_GREEN_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_last_green(suite, digest):
+    """Record the input digest of a green run of a suite"""
+    last_green = load_last_green()
+    last_green[suite] = digest
+    with open(LAST_GREEN_FILE, 'w') as f:
+        json.dump(last_green, f)
+
+class OutcomeCounter:
+    """pytest plugin counting the passed and skipped tests of a run"""
+
+    def __init__(self):
+        self.passed = 0
+        self.skipped = 0
+
+    def pytest_runtest_logreport(self, report):
+        # With pytest-xdist the workers' reports are replayed in this process
+        if report.skipped:
+            self.skipped += 1
+        elif report.passed and report.when == 'call':
+            self.passed += 1
+
+def run_pytest(args, description):
+    """Run pytest in this interpreter and return its success status and test outcomes"""
     print(f"\n{'='*60}")
     print(f"Running: {description}")
-    print(f"Command: {' '.join(cmd)}")
+    print(f"Command: pytest {' '.join(args)}")
     print(f"{'='*60}")
     
+    # Imported here so --install-deps can run before pytest is installed
+    import pytest
+    outcomes = OutcomeCounter()
     try:
-        result = subprocess.run(cmd, check=True, capture_output=False)
-        print(f"✅ {description} - PASSED")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"❌ {description} - FAILED (exit code: {e.returncode})")
-        return False
+        exit_code = pytest.main(args, plugins=[outcomes])
     except Exception as e:
         print(f"❌ {description} - ERROR: {e}")
-        return False
+        return False, outcomes
+    
+    if exit_code == pytest.ExitCode.OK:
+        print(f"✅ {description} - PASSED")
+        return True, outcomes
+    print(f"❌ {description} - FAILED (exit code: {int(exit_code)})")
+    return False, outcomes
 
 def install_dependencies():
     """Install test dependencies"""
@@ -42,29 +109,28 @@ def install_dependencies():
 
 def run_unit_tests():
     """Run unit tests"""
-    cmd = [sys.executable, '-m', 'pytest', 'test_unit.py', '-v', '--tb=short']
-    return run_command(cmd, "Unit Tests")
+    return run_pytest(['test_unit.py', '-v', '--tb=short'] + PYTEST_ARGS, "Unit Tests")
 
 def run_integration_tests():
     """Run integration tests"""
-    cmd = [sys.executable, '-m', 'pytest', 'test_integration.py', '-v', '--tb=short']
-    return run_command(cmd, "Integration Tests")
+    return run_pytest(['test_integration.py', '-v', '--tb=short'] + PYTEST_ARGS,
+                      "Integration Tests")
 
 def run_e2e_tests():
     """Run end-to-end tests"""
-    cmd = [sys.executable, '-m', 'pytest', 'test_e2e.py', '-v', '--tb=short']
-    return run_command(cmd, "End-to-End Tests")
+    return run_pytest(['test_e2e.py', '-v', '--tb=short'], "End-to-End Tests")
 
 def run_all_tests():
     """Run all tests"""
-    cmd = [sys.executable, '-m', 'pytest', '.', '-v', '--tb=short']
-    return run_command(cmd, "All Tests")
+    return run_pytest(['.', '-v', '--tb=short'] + PYTEST_ARGS, "All Tests")
 
 def run_tests_with_coverage():
     """Run all tests with coverage report"""
-    cmd = [sys.executable, '-m', 'pytest', '.', '-v', '--tb=short', 
-           '--cov=../backend', '--cov-report=html', '--cov-report=term']
-    return run_command(cmd, "All Tests with Coverage")
+    # pytest-cov combines the workers' data and writes the reports once
+    args = ['.', '-v', '--tb=short',
+            '--cov=../backend', '--cov-context=test',
+            '--cov-report=html', '--cov-report=term'] + PYTEST_ARGS
+    return run_pytest(args, "All Tests with Coverage")
 
 def main():
     parser = argparse.ArgumentParser(description='Run tests for Diamond Price Prediction Application')
@@ -75,31 +141,51 @@ def main():
     parser.add_argument('--e2e', action='store_true', help='Run end-to-end tests only')
     parser.add_argument('--coverage', action='store_true', help='Run all tests with coverage report')
     parser.add_argument('--all', action='store_true', help='Run all tests (default)')
+    parser.add_argument('--force', action='store_true',
+                       help='Run even if nothing changed since the last green run')
     
     args = parser.parse_args()
     
     # Change to tests directory
     os.chdir(os.path.dirname(__file__))
     
-    # Install dependencies if requested
+    # Install dependencies if requested, then run the tests in a fresh
+    # interpreter so the newly installed packages are importable
     if args.install_deps:
         if not install_dependencies():
             sys.exit(1)
+        argv = [arg for arg in sys.argv[1:] if arg != '--install-deps']
+        sys.exit(subprocess.call([sys.executable, os.path.abspath(__file__)] + argv))
     
     # Determine which tests to run
     results = []
     
     if args.unit:
-        results.append(run_unit_tests())
+        suite, run_suite = 'unit', run_unit_tests
     elif args.integration:
-        results.append(run_integration_tests())
+        suite, run_suite = 'integration', run_integration_tests
     elif args.e2e:
-        results.append(run_e2e_tests())
+        suite, run_suite = 'e2e', run_e2e_tests
     elif args.coverage:
-        results.append(run_tests_with_coverage())
+        suite, run_suite = 'coverage', run_tests_with_coverage
     else:
         # Default: run all tests
-        results.append(run_all_tests())
+        suite, run_suite = 'all', run_all_tests
+    
+    # A coverage run is asked for its report, so it always runs
+    digest = inputs_digest(suite)
+    if suite != 'coverage' and not args.force and load_last_green().get(suite) == digest:
+        print(f"✅ No changes since the last green {suite} run - skipping (use --force to rerun)")
+        sys.exit(0)
+    
+    suite_passed, outcomes = run_suite()
+    results.append(suite_passed)
+    # A run that skipped tests (backend or Chrome unavailable) proves nothing
+    # about them, so only a fully passing run can be reused next time
+    if suite_passed and outcomes.passed and not outcomes.skipped:
+        save_last_green(suite, digest)
+    elif suite_passed:
+        print(f"⚠️ {outcomes.skipped} test(s) skipped - not recording a green {suite} run")
     
     # Summary
     print(f"\n{'='*60}")
@@ -10,100 +10,69 @@ import requests
 import json
 import time
 import os
-import subprocess
-import signal
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import Select
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.common.exceptions import TimeoutException, WebDriverException
+from concurrent.futures import ThreadPoolExecutor
 
-class TestCompleteUserWorkflow:
-    """Test complete user workflows end-to-end"""
-    
-    @pytest.fixture(scope="class")
-    def backend_server(self):
-        """Start backend server for E2E tests"""
-        backend_process = None
-        try:
-            # Check if backend is already running
-            response = requests.get('http://127.0.0.1:5000/health', timeout=2)
-            if response.status_code == 200:
-                yield "already_running"
-                return
-        except:
-            pass
-        
-        # Start backend server
-        backend_dir = os.path.join(os.path.dirname(__file__), '..', 'backend')
-        backend_process = subprocess.Popen(
-            ['python', 'app.py'],
-            cwd=os.path.join(os.path.dirname(__file__), '..'),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        
-        # Wait for server to start
-        for _ in range(30):  # Wait up to 30 seconds
-            try:
-                response = requests.get('http://127.0.0.1:5000/health', timeout=1)
-                if response.status_code == 200:
-                    break
-            except:
-                time.sleep(1)
-        else:
-            if backend_process:
-                backend_process.terminate()
-            pytest.skip("Could not start backend server for E2E tests")
-        
-        yield backend_process
-        
-        # Cleanup
-        if backend_process:
-            backend_process.terminate()
-            backend_process.wait()
+FRONTEND_URL = 'file://' + os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', 'frontend', 'index.html'))
 
-    @pytest.fixture(scope="class")
-    def web_driver(self):
-        """Set up Chrome WebDriver for E2E tests"""
-        try:
-            chrome_options = Options()
-            chrome_options.add_argument("--headless")  # Run in headless mode
-            chrome_options.add_argument("--no-sandbox")
-            chrome_options.add_argument("--disable-dev-shm-usage")
-            chrome_options.add_argument("--disable-gpu")
-            chrome_options.add_argument("--window-size=1920,1080")
-            
-            service = Service(ChromeDriverManager().install())
-            driver = webdriver.Chrome(service=service, options=chrome_options)
-            driver.implicitly_wait(10)
-            
-            yield driver
-            
-        except Exception as e:
-            pytest.skip(f"Could not set up Chrome WebDriver: {e}")
-        finally:
-            try:
-                driver.quit()
-            except:
-                pass
+# Element id of the prediction form's submit button
+PREDICT_BUTTON_ID = 'predictBtn'
 
-    def test_complete_prediction_workflow_with_default_values(self, backend_server, web_driver):
+# Explicit waits only (no implicit wait on the driver), polled every 100ms
+PAGE_TIMEOUT = 5
+RESULT_TIMEOUT = 8
+POLL_INTERVAL = 0.1
+
+def open_frontend(driver):
+    """Load the frontend, or reset it if a previous test left it idle in this browser"""
+    if driver.current_url == FRONTEND_URL and driver.execute_script("""
+        if (document.getElementById('predictBtn').disabled) {
+            return false;  // a prediction is still in flight
+        }
+        document.getElementById('predictionForm').reset();
+        const result = document.getElementById('result');
+        result.innerHTML = '';
+        result.style.display = 'none';
+        return true;
+    """):
+        return
+    driver.get(FRONTEND_URL)
+
+
+def use_backend(driver, backend_url):
+    """Send the loaded frontend's predictions to backend_url"""
+    driver.execute_script("""
+        const backendUrl = arguments[0];
+        window.originalPost = window.originalPost || axios.post;
+        axios.post = function(url, data) {
+            return window.originalPost(backendUrl + '/predict', data);
+        };
+    """, backend_url)
+
+
+class TestCompleteUserWorkflow:
+    """Test complete user workflows end-to-end
+
+    The backend_server fixture is session-scoped and web_driver comes from a
+    browser pool (conftest.py).
+    """
+    
+    def test_complete_prediction_workflow_with_default_values(self, backend_server, backend_url, web_driver):
         """Test 1: Complete prediction workflow using default form values"""
-        # Open the frontend HTML file
-        frontend_path = os.path.join(os.path.dirname(__file__), '..', 'frontend', 'index.html')
-        frontend_url = f"file://{os.path.abspath(frontend_path)}"
+        # Imported here so API-only test runs do not load Selenium
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
         
-        web_driver.get(frontend_url)
+        # Open the frontend HTML file
+        open_frontend(web_driver)
         
         # Wait for page to load
-        WebDriverWait(web_driver, 10).until(
+        WebDriverWait(web_driver, PAGE_TIMEOUT, poll_frequency=POLL_INTERVAL).until(
             EC.presence_of_element_located((By.TAG_NAME, "h1"))
         )
+        use_backend(web_driver, backend_url)
         
         # Verify page title and main heading
         assert "Diamond Price Prediction" in web_driver.title
@@ -111,7 +80,7 @@ class TestCompleteUserWorkflow:
         assert "Diamond Price Prediction" in heading.text
         
         # Find and click the predict button (form should have default values)
-        predict_button = web_driver.find_element(By.CSS_SELECTOR, "button[type='submit']")
+        predict_button = web_driver.find_element(By.ID, PREDICT_BUTTON_ID)
         assert predict_button.is_enabled()
         
         # Click predict button
@@ -119,7 +88,7 @@ class TestCompleteUserWorkflow:
         
         # Wait for result (either success or error)
         try:
-            WebDriverWait(web_driver, 15).until(
+            WebDriverWait(web_driver, RESULT_TIMEOUT, poll_frequency=POLL_INTERVAL).until(
                 EC.presence_of_element_located((By.ID, "result"))
             )
             
@@ -138,17 +107,21 @@ class TestCompleteUserWorkflow:
         except TimeoutException:
             pytest.fail("Prediction request timed out")
 
-    def test_form_input_validation_and_submission(self, backend_server, web_driver):
+    def test_form_input_validation_and_submission(self, backend_server, backend_url, web_driver):
         """Test 2: Form input validation and custom value submission"""
-        frontend_path = os.path.join(os.path.dirname(__file__), '..', 'frontend', 'index.html')
-        frontend_url = f"file://{os.path.abspath(frontend_path)}"
+        # Imported here so API-only test runs do not load Selenium
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
         
-        web_driver.get(frontend_url)
+        open_frontend(web_driver)
         
         # Wait for form to load
-        WebDriverWait(web_driver, 10).until(
+        WebDriverWait(web_driver, PAGE_TIMEOUT, poll_frequency=POLL_INTERVAL).until(
             EC.presence_of_element_located((By.ID, "predictionForm"))
         )
+        use_backend(web_driver, backend_url)
         
         # Test form inputs with custom values
         test_values = {
@@ -160,40 +133,41 @@ class TestCompleteUserWorkflow:
             'z': '4.6'
         }
         
-        # Fill in numerical inputs
-        for field_name, value in test_values.items():
-            field = web_driver.find_element(By.CSS_SELECTOR, f"input[name='{field_name}']")
-            field.clear()
-            field.send_keys(value)
-        
-        # Test dropdown selections
-        cut_select = Select(web_driver.find_element(By.CSS_SELECTOR, "select[name='cut']"))
-        cut_select.select_by_value("Premium")
-        
-        color_select = Select(web_driver.find_element(By.CSS_SELECTOR, "select[name='color']"))
-        color_select.select_by_value("G")
+        # Custom dropdown selections
+        test_values.update({'cut': 'Premium', 'color': 'G', 'clarity': 'VS1'})
         
-        clarity_select = Select(web_driver.find_element(By.CSS_SELECTOR, "select[name='clarity']"))
-        clarity_select.select_by_value("VS1")
+        # Fill every input and dropdown in one WebDriver round trip
+        web_driver.execute_script("""
+            for (const [name, value] of Object.entries(arguments[0])) {
+                const field = document.getElementById(name);
+                field.value = value;
+                field.dispatchEvent(new Event('input', {bubbles: true}));
+                field.dispatchEvent(new Event('change', {bubbles: true}));
+            }
+        """, test_values)
         
         # Verify values were set
-        assert web_driver.find_element(By.CSS_SELECTOR, "input[name='carat']").get_attribute('value') == '1.5'
-        assert cut_select.first_selected_option.get_attribute('value') == 'Premium'
-        assert color_select.first_selected_option.get_attribute('value') == 'G'
-        assert clarity_select.first_selected_option.get_attribute('value') == 'VS1'
+        form_values = web_driver.execute_script("""
+            const values = {};
+            for (const name of arguments[0]) {
+                values[name] = document.getElementById(name).value;
+            }
+            return values;
+        """, list(test_values))
+        assert form_values == test_values
         
         # Submit form
-        predict_button = web_driver.find_element(By.CSS_SELECTOR, "button[type='submit']")
+        predict_button = web_driver.find_element(By.ID, PREDICT_BUTTON_ID)
         predict_button.click()
         
         # Wait for button text to change to "Predicting..."
-        WebDriverWait(web_driver, 5).until(
+        WebDriverWait(web_driver, PAGE_TIMEOUT, poll_frequency=POLL_INTERVAL).until(
             lambda driver: "Predicting" in predict_button.text or predict_button.is_enabled()
         )
         
         # Wait for result
         try:
-            WebDriverWait(web_driver, 15).until(
+            WebDriverWait(web_driver, RESULT_TIMEOUT, poll_frequency=POLL_INTERVAL).until(
                 EC.presence_of_element_located((By.ID, "result"))
             )
             
@@ -205,32 +179,29 @@ class TestCompleteUserWorkflow:
 
     def test_error_handling_with_backend_down(self, web_driver):
         """Test 3: Error handling when backend is not available"""
-        frontend_path = os.path.join(os.path.dirname(__file__), '..', 'frontend', 'index.html')
-        frontend_url = f"file://{os.path.abspath(frontend_path)}"
+        # Imported here so API-only test runs do not load Selenium
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
         
-        web_driver.get(frontend_url)
+        open_frontend(web_driver)
         
         # Wait for form to load
-        WebDriverWait(web_driver, 10).until(
+        WebDriverWait(web_driver, PAGE_TIMEOUT, poll_frequency=POLL_INTERVAL).until(
             EC.presence_of_element_located((By.ID, "predictionForm"))
         )
         
         # Modify the frontend to point to a non-existent backend
-        web_driver.execute_script("""
-            // Override the axios request to point to a non-existent port
-            const originalPost = axios.post;
-            axios.post = function(url, data) {
-                return originalPost('http://127.0.0.1:9999/predict', data);
-            };
-        """)
+        use_backend(web_driver, 'http://127.0.0.1:9999')
         
         # Submit form
-        predict_button = web_driver.find_element(By.CSS_SELECTOR, "button[type='submit']")
+        predict_button = web_driver.find_element(By.ID, PREDICT_BUTTON_ID)
         predict_button.click()
         
         # Wait for error message
         try:
-            WebDriverWait(web_driver, 10).until(
+            WebDriverWait(web_driver, RESULT_TIMEOUT, poll_frequency=POLL_INTERVAL).until(
                 EC.presence_of_element_located((By.ID, "result"))
             )
             
@@ -248,7 +219,7 @@ class TestCompleteUserWorkflow:
 class TestAPIWorkflowIntegration:
     """Test API workflow integration without browser"""
     
-    def test_complete_api_workflow_with_valid_data(self):
+    def test_complete_api_workflow_with_valid_data(self, backend_ready, predict):
         """Test 4: Complete API workflow with valid diamond data"""
         # Test data representing a high-quality diamond
         test_diamond = {
@@ -264,18 +235,8 @@ class TestAPIWorkflowIntegration:
         }
         
         try:
-            # First, check if backend is running
-            health_response = requests.get('http://127.0.0.1:5000/health', timeout=5)
-            
-            if health_response.status_code != 200:
-                pytest.skip("Backend not running - skipping API workflow test")
-            
             # Test the complete workflow
-            prediction_response = requests.post(
-                'http://127.0.0.1:5000/predict',
-                json=[test_diamond],
-                timeout=15
-            )
+            prediction_response = predict([test_diamond])
             
             # Verify response
             assert prediction_response.status_code in [200, 500]  # 500 if model not loaded
@@ -301,12 +262,10 @@ class TestAPIWorkflowIntegration:
                 assert 'error' in response_data
                 assert 'model not loaded' in response_data['error'].lower()
                 
-        except requests.exceptions.ConnectionError:
-            pytest.skip("Backend not running - skipping API workflow test")
         except requests.exceptions.Timeout:
             pytest.fail("API workflow test timed out")
 
-    def test_api_workflow_with_multiple_diamonds(self):
+    def test_api_workflow_with_multiple_diamonds(self, backend_ready, predict):
         """Test 5: API workflow with multiple diamond predictions"""
         # Test data with multiple diamonds of different qualities
         test_diamonds = [
@@ -335,18 +294,8 @@ class TestAPIWorkflowIntegration:
         ]
         
         try:
-            # Check if backend is running
-            health_response = requests.get('http://127.0.0.1:5000/health', timeout=5)
-            
-            if health_response.status_code != 200:
-                pytest.skip("Backend not running - skipping multiple diamonds test")
-            
             # Test multiple predictions
-            prediction_response = requests.post(
-                'http://127.0.0.1:5000/predict',
-                json=test_diamonds,
-                timeout=15
-            )
+            prediction_response = predict(test_diamonds)
             
             if prediction_response.status_code == 200:
                 response_data = prediction_response.json()
@@ -369,12 +318,10 @@ class TestAPIWorkflowIntegration:
                 response_data = prediction_response.json()
                 assert 'error' in response_data
                 
-        except requests.exceptions.ConnectionError:
-            pytest.skip("Backend not running - skipping multiple diamonds test")
         except requests.exceptions.Timeout:
             pytest.fail("Multiple diamonds test timed out")
 
-    def test_api_response_time_performance(self):
+    def test_api_response_time_performance(self, warm_model, backend_url, http_session):
         """Test 6: API response time performance"""
         test_diamond = {
             'carat': 0.5,
@@ -389,16 +336,10 @@ class TestAPIWorkflowIntegration:
         }
         
         try:
-            # Check if backend is running
-            health_response = requests.get('http://127.0.0.1:5000/health', timeout=5)
-            
-            if health_response.status_code != 200:
-                pytest.skip("Backend not running - skipping performance test")
-            
             # Measure response time
             start_time = time.time()
-            prediction_response = requests.post(
-                'http://127.0.0.1:5000/predict',
+            prediction_response = http_session.post(
+                f'{backend_url}/predict',
                 json=[test_diamond],
                 timeout=10
             )
@@ -409,15 +350,11 @@ class TestAPIWorkflowIntegration:
             # API should respond within reasonable time (10 seconds max)
             assert response_time < 10.0
             
-            # For a loaded model, response should be quite fast (under 5 seconds)
-            if prediction_response.status_code == 200:
-                assert response_time < 5.0
-            
-            # Verify we got a valid response
-            assert prediction_response.status_code in [200, 500]
+            # A loaded, warmed-up model should answer quickly; the bound leaves
+            # room for busy CI runners shared by parallel workers
+            assert prediction_response.status_code == 200
+            assert response_time < 2.0
             
-        except requests.exceptions.ConnectionError:
-            pytest.skip("Backend not running - skipping performance test")
         except requests.exceptions.Timeout:
             pytest.fail("Performance test timed out")
 
@@ -425,7 +362,7 @@ class TestAPIWorkflowIntegration:
 class TestDataPersistenceAndConsistency:
     """Test data persistence and consistency across requests"""
     
-    def test_model_consistency_across_requests(self):
+    def test_model_consistency_across_requests(self, model_status, predict):
         """Test 7: Model predictions are consistent for identical inputs"""
         test_diamond = {
             'carat': 0.7,
@@ -440,50 +377,32 @@ class TestDataPersistenceAndConsistency:
         }
         
         try:
-            # Check if backend is running and model is loaded
-            health_response = requests.get('http://127.0.0.1:5000/health', timeout=5)
-            
-            if health_response.status_code != 200:
-                pytest.skip("Backend not running - skipping consistency test")
-            
-            health_data = health_response.json()
-            if health_data.get('model_status') != 'loaded':
+            if model_status != 'loaded':
                 pytest.skip("Model not loaded - skipping consistency test")
             
             # Make multiple requests with identical data
             predictions = []
             for i in range(3):
-                response = requests.post(
-                    'http://127.0.0.1:5000/predict',
-                    json=[test_diamond],
-                    timeout=10
-                )
+                response = predict([test_diamond], timeout=10, force=True)
                 
                 assert response.status_code == 200
                 data = response.json()
                 assert 'predicted_price' in data
                 predictions.append(data['predicted_price'][0])
-                
-                # Small delay between requests
-                time.sleep(0.1)
             
             # All predictions should be identical
             assert len(set(predictions)) == 1, f"Predictions not consistent: {predictions}"
             
-        except requests.exceptions.ConnectionError:
-            pytest.skip("Backend not running - skipping consistency test")
         except requests.exceptions.Timeout:
             pytest.fail("Consistency test timed out")
 
-    def test_health_endpoint_reliability(self):
+    def test_health_endpoint_reliability(self, backend_ready, backend_url, http_session):
         """Test 8: Health endpoint reliability and information accuracy"""
         try:
-            # Make multiple health check requests
-            health_responses = []
-            for i in range(5):
-                response = requests.get('http://127.0.0.1:5000/health', timeout=5)
-                health_responses.append(response)
-                time.sleep(0.2)
+            # Make multiple concurrent health check requests
+            with ThreadPoolExecutor(max_workers=5) as executor:
+                health_responses = list(executor.map(
+                    lambda _: http_session.get(f'{backend_url}/health', timeout=5), range(5)))
             
             # All health checks should succeed
             for response in health_responses:
@@ -499,18 +418,16 @@ class TestDataPersistenceAndConsistency:
                 assert data['status'] == 'healthy'
                 
                 # Model status should be consistent
-                assert data['model_status'] in ['loaded', 'not loaded']
+                assert data['model_status'] in ['not loaded', 'loading', 'loaded', 'failed']
             
             # Model status should be consistent across all requests
             model_statuses = [resp.json()['model_status'] for resp in health_responses]
             assert len(set(model_statuses)) == 1, f"Model status inconsistent: {model_statuses}"
             
-        except requests.exceptions.ConnectionError:
-            pytest.skip("Backend not running - skipping health reliability test")
         except requests.exceptions.Timeout:
             pytest.fail("Health reliability test timed out")
 
-    def test_complete_user_journey_simulation(self):
+    def test_complete_user_journey_simulation(self, backend_ready, predict):
         """Test 9: Complete user journey from start to finish"""
         # Simulate a complete user journey
         user_diamonds = [
@@ -550,38 +467,25 @@ class TestDataPersistenceAndConsistency:
         ]
         
         try:
-            # Check if backend is running
-            health_response = requests.get('http://127.0.0.1:5000/health', timeout=5)
+            predictions = []
             
-            if health_response.status_code != 200:
-                pytest.skip("Backend not running - skipping user journey test")
+            # Send all of the user's queries in one batch request
+            response = predict(user_diamonds)
             
-            predictions = []
+            # The batch should succeed (or fail consistently)
+            assert response.status_code in [200, 500]
             
-            # Simulate user making multiple queries
-            for i, diamond in enumerate(user_diamonds):
-                response = requests.post(
-                    'http://127.0.0.1:5000/predict',
-                    json=[diamond],
-                    timeout=10
-                )
-                
-                # Each request should succeed (or fail consistently)
-                assert response.status_code in [200, 500]
+            if response.status_code == 200:
+                data = response.json()
+                assert 'predicted_price' in data
+                predictions = data['predicted_price']
+                assert len(predictions) == len(user_diamonds)
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    assert 'predicted_price' in data
-                    prediction = data['predicted_price'][0]
-                    predictions.append(prediction)
-                    
+                for prediction in predictions:
                     # Verify prediction is reasonable
                     assert isinstance(prediction, (int, float))
                     assert prediction > 0
                     assert 100 <= prediction <= 100000  # Reasonable price range
-                
-                # Simulate user thinking time between queries
-                time.sleep(0.5)
             
             # If we got predictions, verify they make business sense
             if len(predictions) >= 2:
@@ -599,8 +503,6 @@ class TestDataPersistenceAndConsistency:
                     budget_price = predictions[2]
                     assert budget_price < engagement_price
             
-        except requests.exceptions.ConnectionError:
-            pytest.skip("Backend not running - skipping user journey test")
         except requests.exceptions.Timeout:
             pytest.fail("User journey test timed out")
 
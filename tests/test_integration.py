@@ -6,28 +6,21 @@ such as API endpoints, data processing pipelines, and model integration.
 """
 
 import pytest
+import numpy as np
+import pandas as pd
+import orjson
 import requests
-import json
-import time
 import os
+import re
 import sys
-from unittest.mock import patch, Mock
+from requests_mock import ANY
 
 # Add the backend directory to the path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
 
-from app import app
-
 class TestAPIEndpoints:
     """Test API endpoint integration"""
     
-    @pytest.fixture
-    def client(self):
-        """Create a test client for the Flask app"""
-        app.config['TESTING'] = True
-        with app.test_client() as client:
-            yield client
-    
     def test_health_endpoint_integration(self, client):
         """Test 1: Health endpoint returns proper JSON response"""
         response = client.get('/health')
@@ -40,31 +33,19 @@ class TestAPIEndpoints:
         assert 'model_status' in data
         assert 'message' in data
         assert data['status'] == 'healthy'
-        assert data['model_status'] in ['loaded', 'not loaded']
+        assert data['model_status'] in ['not loaded', 'loading', 'loaded', 'failed']
 
-    def test_predict_endpoint_with_valid_data(self, client):
+    def test_predict_endpoint_with_valid_data(self, client, ideal_diamond):
         """Test 2: Predict endpoint handles valid diamond data"""
-        valid_diamond_data = [{
-            'carat': 0.23,
-            'cut': 'Ideal',
-            'color': 'E',
-            'clarity': 'SI2',
-            'depth': 61.5,
-            'table': 55.0,
-            'x': 3.95,
-            'y': 3.98,
-            'z': 2.43
-        }]
+        valid_diamond_data = [ideal_diamond]
         
-        response = client.post('/predict',
-                             data=json.dumps(valid_diamond_data),
-                             content_type='application/json')
+        response = client.post('/predict', json=valid_diamond_data)
         
         # Should return either a prediction or a model not loaded error
         assert response.status_code in [200, 500]
         assert response.content_type == 'application/json'
         
-        data = response.get_json()
+        data = orjson.loads(response.data)
         if response.status_code == 200:
             assert 'predicted_price' in data
             assert isinstance(data['predicted_price'], list)
@@ -80,43 +61,108 @@ class TestAPIEndpoints:
             'invalid_field': 'invalid_value'
         }]
         
-        response = client.post('/predict',
-                             data=json.dumps(invalid_data),
-                             content_type='application/json')
+        response = client.post('/predict', json=invalid_data)
         
         # Should return an error
-        assert response.status_code in [400, 500]
+        assert response.status_code in [400, 422, 500]
         assert response.content_type == 'application/json'
         
-        data = response.get_json()
+        data = orjson.loads(response.data)
         assert 'error' in data
 
+    def test_predict_endpoint_serializes_numpy_predictions(self, client, install_model):
+        """Test 10: Predict endpoint returns numpy model output as a JSON list"""
+        columns = ['carat', 'depth', 'table', 'x', 'y', 'z', 'cut_Ideal', 'color_E', 'clarity_SI2']
+        mock_model = install_model(columns)
+        mock_model.predict.return_value = np.array([326.5], dtype=np.float32)
+
+        response = client.post('/predict', json=[{
+            'carat': 0.23, 'cut': 'Ideal', 'color': 'E', 'clarity': 'SI2',
+            'depth': 61.5, 'table': 55.0, 'x': 3.95, 'y': 3.98, 'z': 2.43
+        }])
+
+        assert response.status_code == 200
+        assert response.get_json() == {'predicted_price': [326.5]}
+        X = mock_model.predict.call_args[0][0]
+        assert X.shape == (1, len(columns))
+        assert X[0].tolist() == pytest.approx([0.23, 61.5, 55.0, 3.95, 3.98, 2.43, 1, 1, 1])
+
+    def test_predict_endpoint_rejects_invalid_records(self, client, install_model):
+        """Test 11: Predict endpoint returns validation errors with HTTP 422"""
+        mock_model = install_model(['carat'])
+
+        response = client.post('/predict', json=[{
+            'carat': 'heavy', 'cut': 'Ideal', 'color': 'E', 'clarity': 'SI2',
+            'depth': 61.5, 'table': 55.0, 'x': 3.95, 'y': 3.98, 'z': 2.43
+        }])
+
+        assert response.status_code == 422
+        data = response.get_json()
+        assert data['error'] == 'Invalid diamond data'
+        assert [error['loc'] for error in data['details']] == [[0, 'carat']]
+        mock_model.predict.assert_not_called()
+
+    def test_predict_endpoint_rejects_non_json_body(self, client, install_model):
+        """Test 14: Predict endpoint answers a non-JSON body with a JSON 422"""
+        mock_model = install_model(['carat'])
+
+        response = client.post('/predict', data='notjson', content_type='application/json')
+
+        assert response.status_code == 422
+        assert response.content_type == 'application/json'
+        data = orjson.loads(response.data)
+        assert data['error'] == 'Invalid diamond data'
+        assert all('input' not in error for error in data['details'])
+        mock_model.predict.assert_not_called()
+
+    def test_predict_endpoint_caches_repeated_records(self, client, install_model):
+        """Test 12: Repeated records are served from the prediction cache"""
+        columns = ['carat', 'depth', 'table', 'x', 'y', 'z']
+        mock_model = install_model(columns)
+        mock_model.predict.side_effect = lambda X: X[:, 0] * 1000
+
+        diamond = {'carat': 0.5, 'cut': 'Ideal', 'color': 'E', 'clarity': 'SI2',
+                   'depth': 61.5, 'table': 55.0, 'x': 5.0, 'y': 5.0, 'z': 3.1}
+        first = client.post('/predict', json=[diamond])
+        # Same record with its keys reordered, plus a new one
+        reordered = dict(reversed(list(diamond.items())))
+        second = client.post('/predict', json=[reordered, dict(diamond, carat=0.25)])
+
+        assert first.get_json() == {'predicted_price': [500.0]}
+        assert second.get_json() == {'predicted_price': [500.0, 250.0]}
+        assert mock_model.predict.call_count == 2
+        assert mock_model.predict.call_args[0][0].shape == (1, len(columns))
+
+    @pytest.mark.parametrize("n", [1, 32, 1024])
+    def test_predict_endpoint_scales_with_batch_size(self, client, install_model, ideal_diamond, n):
+        """Test 13: One request predicts batches of 1, 32 and 1024 diamonds"""
+        columns = ['carat', 'depth', 'table', 'x', 'y', 'z', 'cut_Ideal', 'color_E', 'clarity_SI2']
+        mock_model = install_model(columns)
+        mock_model.predict.side_effect = lambda X: X[:, 0] * 1000
+
+        # Distinct carats so no record is served from the prediction cache
+        carats = [round(0.2 + i / 1000, 3) for i in range(n)]
+        response = client.post('/predict', json=[dict(ideal_diamond, carat=c) for c in carats])
+
+        assert response.status_code == 200
+        prices = orjson.loads(response.data)['predicted_price']
+        assert len(prices) == n
+        assert prices == pytest.approx([c * 1000 for c in carats], rel=1e-5)
+        mock_model.predict.assert_called_once()
+        assert mock_model.predict.call_args[0][0].shape == (n, len(columns))
+
 
 class TestDataFlowIntegration:
     """Test data flow through the entire prediction pipeline"""
     
-    def test_data_preprocessing_pipeline(self):
+    def test_data_preprocessing_pipeline(self, encode_features, premium_diamond):
         """Test 4: Complete data preprocessing pipeline"""
-        import pandas as pd
         
         # Test data that mimics what comes from the frontend
-        frontend_data = [{
-            'carat': 0.5,
-            'cut': 'Premium',
-            'color': 'G',
-            'clarity': 'VS1',
-            'depth': 62.0,
-            'table': 57.0,
-            'x': 5.0,
-            'y': 5.0,
-            'z': 3.1
-        }]
-        
-        # Convert to DataFrame (as done in the app)
-        df = pd.DataFrame(frontend_data)
+        frontend_data = [premium_diamond]
         
         # Apply one-hot encoding (as done in the app)
-        df_processed = pd.get_dummies(df)
+        df_processed = encode_features(frontend_data)
         
         # Verify the pipeline works end-to-end
         assert isinstance(df_processed, pd.DataFrame)
@@ -124,19 +170,19 @@ class TestDataFlowIntegration:
         
         # Check that all numerical columns are preserved
         numerical_cols = ['carat', 'depth', 'table', 'x', 'y', 'z']
-        for col in numerical_cols:
-            assert col in df_processed.columns
-            assert pd.api.types.is_numeric_dtype(df_processed[col])
+        assert set(numerical_cols) <= set(df_processed.columns)
+        numeric = df_processed[numerical_cols].to_numpy(copy=False)
+        assert np.issubdtype(numeric.dtype, np.number)
+        assert numeric[0] == pytest.approx([frontend_data[0][col] for col in numerical_cols])
         
         # Check that categorical columns are one-hot encoded
-        assert any(col.startswith('cut_') for col in df_processed.columns)
-        assert any(col.startswith('color_') for col in df_processed.columns)
-        assert any(col.startswith('clarity_') for col in df_processed.columns)
+        assert df_processed['cut_Premium'].iloc[0] == 1
+        assert df_processed['color_G'].iloc[0] == 1
+        assert df_processed['clarity_VS1'].iloc[0] == 1
+        assert df_processed.iloc[0].filter(like='_').sum() == 3
 
-    def test_model_prediction_pipeline_with_mock(self):
+    def test_model_prediction_pipeline_with_mock(self, mock_predictor):
         """Test 5: Model prediction pipeline with mocked model"""
-        import pandas as pd
-        from unittest.mock import Mock
         
         # Create test data
         test_data = pd.DataFrame([{
@@ -147,29 +193,20 @@ class TestDataFlowIntegration:
             'clarity_SI1': 1, 'clarity_VS1': 0
         }])
         
-        # Mock a model
-        mock_model = Mock()
-        mock_model.predict.return_value = [1500.0]  # Mock prediction
-        
         # Test that the model interface works
-        prediction = mock_model.predict(test_data)
+        prediction = mock_predictor.predict(test_data)
         
-        assert isinstance(prediction, list)
+        assert isinstance(prediction, np.ndarray)
+        assert prediction.dtype == np.float32
         assert len(prediction) == 1
-        assert isinstance(prediction[0], float)
         assert prediction[0] > 0
+        assert prediction.tolist() == [1500.0]
 
-    def test_column_alignment_integration(self):
+    def test_column_alignment_integration(self, feature_template):
         """Test 6: Column alignment between training and inference"""
-        import pandas as pd
         
-        # Simulate training columns (what the model expects)
-        training_columns = [
-            'carat', 'depth', 'table', 'x', 'y', 'z',
-            'cut_Fair', 'cut_Good', 'cut_Ideal', 'cut_Premium', 'cut_Very Good',
-            'color_D', 'color_E', 'color_F', 'color_G', 'color_H', 'color_I', 'color_J',
-            'clarity_FL', 'clarity_IF', 'clarity_SI1', 'clarity_SI2', 'clarity_VS1', 'clarity_VS2', 'clarity_VVS1', 'clarity_VVS2', 'clarity_I1'
-        ]
+        # Training columns (what the model expects)
+        training_columns = list(feature_template.columns)
         
         # Simulate inference data (what we get from the frontend)
         inference_data = pd.DataFrame([{
@@ -180,8 +217,10 @@ class TestDataFlowIntegration:
             'clarity_VS1': 1  # Only one clarity present
         }])
         
-        # Test column alignment (as done in the app)
-        df_aligned = inference_data.reindex(columns=training_columns, fill_value=0)
+        # Align by writing the observed columns into a copy of the zero template
+        df_aligned = feature_template.copy()
+        for col in inference_data.columns:
+            df_aligned[col] = inference_data[col].values
         
         # Verify alignment worked
         assert list(df_aligned.columns) == training_columns
@@ -192,87 +231,80 @@ class TestDataFlowIntegration:
         assert df_aligned['cut_Ideal'].iloc[0] == 1
         assert df_aligned['color_D'].iloc[0] == 0
         assert df_aligned['color_F'].iloc[0] == 1
+        assert df_aligned['carat'].iloc[0] == 0.25
+        
+        # The shared template itself stays all zeros
+        assert not feature_template.to_numpy().any()
 
 
 class TestExternalServiceIntegration:
-    """Test integration with external services (if backend is running)"""
+    """Test the backend as an external HTTP service
+
+    Requests to http://127.0.0.1:5000 are answered in-process by the Flask app
+    through requests-mock, so no server or socket is needed.
+    """
+
+    @pytest.fixture(autouse=True)
+    def live_backend(self, requests_mock, client):
+        """Route HTTP requests for the backend URL to the Flask app"""
+        def dispatch(request, context):
+            response = client.open(request.path_url, method=request.method,
+                                   data=request.body, headers=dict(request.headers))
+            context.status_code = response.status_code
+            context.headers = dict(response.headers)
+            return response.get_data()
+
+        requests_mock.register_uri(ANY, re.compile(r'^http://127\.0\.0\.1:5000/'), content=dispatch)
     
     def test_live_backend_health_check(self):
-        """Test 7: Live backend health check (if running)"""
-        try:
-            response = requests.get('http://127.0.0.1:5000/health', timeout=5)
-            
-            # If backend is running, test it
-            if response.status_code == 200:
-                data = response.json()
-                assert 'status' in data
-                assert 'model_status' in data
-                assert data['status'] == 'healthy'
-            else:
-                pytest.skip("Backend not running - skipping live test")
-                
-        except requests.exceptions.ConnectionError:
-            pytest.skip("Backend not running - skipping live test")
-        except requests.exceptions.Timeout:
-            pytest.skip("Backend timeout - skipping live test")
-
-    def test_live_backend_prediction(self):
-        """Test 8: Live backend prediction (if running and model loaded)"""
-        try:
-            # First check if backend is running
-            health_response = requests.get('http://127.0.0.1:5000/health', timeout=5)
-            
-            if health_response.status_code != 200:
-                pytest.skip("Backend not running - skipping live test")
-            
-            health_data = health_response.json()
-            if health_data.get('model_status') != 'loaded':
-                pytest.skip("Model not loaded - skipping live test")
-            
-            # Test prediction
-            test_data = [{
-                'carat': 0.23,
-                'cut': 'Ideal',
-                'color': 'E',
-                'clarity': 'SI2',
-                'depth': 61.5,
-                'table': 55.0,
-                'x': 3.95,
-                'y': 3.98,
-                'z': 2.43
-            }]
-            
-            response = requests.post('http://127.0.0.1:5000/predict',
-                                   json=test_data,
-                                   timeout=10)
-            
-            assert response.status_code == 200
-            data = response.json()
-            assert 'predicted_price' in data
-            assert isinstance(data['predicted_price'], list)
-            assert len(data['predicted_price']) == 1
-            assert data['predicted_price'][0] > 0
-            
-        except requests.exceptions.ConnectionError:
-            pytest.skip("Backend not running - skipping live test")
-        except requests.exceptions.Timeout:
-            pytest.skip("Backend timeout - skipping live test")
+        """Test 7: Live backend health check"""
+        response = requests.get('http://127.0.0.1:5000/health', timeout=5)
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert 'status' in data
+        assert 'model_status' in data
+        assert data['status'] == 'healthy'
+
+    def test_live_backend_prediction(self, install_model):
+        """Test 8: Live backend prediction through the HTTP API"""
+        columns = ['carat', 'depth', 'table', 'x', 'y', 'z', 'cut_Ideal', 'color_E', 'clarity_SI2']
+        mock_model = install_model(columns)
+        mock_model.predict.return_value = np.array([326.5], dtype=np.float32)
+        
+        # Test prediction
+        test_data = [{
+            'carat': 0.23,
+            'cut': 'Ideal',
+            'color': 'E',
+            'clarity': 'SI2',
+            'depth': 61.5,
+            'table': 55.0,
+            'x': 3.95,
+            'y': 3.98,
+            'z': 2.43
+        }]
+        
+        response = requests.post('http://127.0.0.1:5000/predict',
+                                 json=test_data,
+                                 timeout=10)
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert 'predicted_price' in data
+        assert isinstance(data['predicted_price'], list)
+        assert data['predicted_price'] == [326.5]
+        mock_model.predict.assert_called_once()
 
     def test_cors_integration(self):
         """Test 9: CORS headers are properly set for frontend integration"""
-        try:
-            response = requests.options('http://127.0.0.1:5000/predict', timeout=5)
-            
-            # Check CORS headers
-            headers = response.headers
-            # The presence of these headers indicates CORS is configured
-            # (exact headers may vary based on Flask-CORS configuration)
-            assert response.status_code in [200, 204]  # OPTIONS should be allowed
-            
-        except requests.exceptions.ConnectionError:
-            pytest.skip("Backend not running - skipping CORS test")
-        except requests.exceptions.Timeout:
-            pytest.skip("Backend timeout - skipping CORS test")
+        response = requests.options('http://127.0.0.1:5000/predict', timeout=5,
+                                    headers={'Origin': 'http://localhost:3000',
+                                             'Access-Control-Request-Method': 'POST'})
+        
+        # OPTIONS should be allowed, and the preflight answered by Flask-CORS
+        assert response.status_code in [200, 204]
+        assert 'Access-Control-Allow-Origin' in response.headers
 
 
 if __name__ == '__main__':